@@ -0,0 +1,8 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def no_data_cache(monkeypatch):
+    # stop the tests (and the scripts they run) writing feather copies
+    # of the data files into data/
+    monkeypatch.setenv("TIDAL_ANALYSIS_CACHE", "0")
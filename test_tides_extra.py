@@ -0,0 +1,246 @@
+import pytest
+import sys
+sys.path.insert(0,"../")
+sys.path.insert(0,"./")
+from tidal_analysis import * 
+import tidal_analysis as tides_module
+import pandas as pd
+import datetime
+import numpy as np
+
+
+class TestTidalAnalysisExtra():
+
+    def test_reading_data_cache(self, tmp_path, monkeypatch):
+        import os
+        import shutil
+
+        monkeypatch.setenv("TIDAL_ANALYSIS_CACHE", "1")
+        tidal_file = str(tmp_path / "1947ABE.txt")
+        shutil.copy("data/1947ABE.txt", tidal_file)
+        cache_file = tides_module._cache_filename(tidal_file)
+
+        # count how often the text file is parsed
+        parsed = []
+        read_file = tides_module._read_tidal_data_file
+        def counting_read(filename):
+            parsed.append(filename)
+            return read_file(filename)
+        monkeypatch.setattr(tides_module, "_read_tidal_data_file", counting_read)
+
+        # first read parses the file and saves the copy
+        expected = read_tidal_data(tidal_file)
+        assert len(parsed) == 1
+        assert os.path.exists(cache_file)
+
+        # a hit reads the copy and gives the same data
+        data = read_tidal_data(tidal_file)
+        assert len(parsed) == 1
+        pd.testing.assert_frame_equal(data, expected)
+
+        # a copy older than the file is stale, so the file is parsed again
+        stat = os.stat(tidal_file)
+        os.utime(cache_file, (stat.st_atime, stat.st_mtime - 10))
+        data = read_tidal_data(tidal_file)
+        assert len(parsed) == 2
+        pd.testing.assert_frame_equal(data, expected)
+        assert os.path.getmtime(cache_file) >= os.path.getmtime(tidal_file)
+
+        # a half written copy is a miss, and is replaced
+        with open(cache_file, "r+b") as cache:
+            cache.truncate(100)
+        data = read_tidal_data(tidal_file)
+        assert len(parsed) == 3
+        pd.testing.assert_frame_equal(data, expected)
+        data = read_tidal_data(tidal_file)
+        assert len(parsed) == 3
+        pd.testing.assert_frame_equal(data, expected)
+
+        # no temporary files are left behind
+        assert sorted(os.listdir(tmp_path)) == sorted(
+            [os.path.basename(tidal_file), os.path.basename(cache_file)])
+
+    def test_longest_contiguous(self):
+
+        data = read_tidal_data("data/1947ABE.txt")
+        contiguous = get_longest_contiguous_data(data)
+
+        assert "Sea Level" in contiguous.columns
+        assert contiguous['Sea Level'].size == 1710
+        assert not contiguous['Sea Level'].isnull().any()
+        assert contiguous.index[0] == pd.Timestamp('1947-05-30 23:00:00')
+        assert contiguous.index[-1] == pd.Timestamp('1947-08-10 04:00:00')
+
+        # the values either side of the block should be missing
+        first = data.index.get_loc(contiguous.index[0])
+        last = data.index.get_loc(contiguous.index[-1])
+        assert np.isnan(data['Sea Level'].iloc[first - 1])
+        assert np.isnan(data['Sea Level'].iloc[last + 1])
+
+    def test_longest_run_kernels(self):
+
+        nan = np.nan
+        cases = [
+            (np.array([]), (0, 0)),
+            (np.array([nan, nan, nan]), (0, 0)),
+            (np.array([nan, 1.0, 2.0, nan, 3.0, nan]), (1, 3)),
+            (np.array([1.0, nan, 2.0, 3.0, 4.0]), (2, 5)),
+            (np.array([1.0, 2.0, nan, 3.0, 4.0]), (0, 2)),
+        ]
+        rng = np.random.default_rng(42)
+        for _ in range(20):
+            values = rng.random(200)
+            values[rng.random(200) < 0.3] = nan
+            cases.append((values, None))
+
+        for values, expected in cases:
+            result = tuple(tides_module._longest_run_numpy(values))
+            assert tuple(tides_module._longest_run(values)) == result
+            assert tuple(tides_module._find_longest_run(values)) == result
+            if expected is not None:
+                assert result == expected
+
+    def test_subtract_mean_kernels(self):
+
+        nan = np.nan
+        cases = [
+            np.array([]),
+            np.array([nan, nan]),
+            np.array([nan, 1.0, 3.0, nan]),
+            np.array([1.0, 2.0, 6.0]),
+        ]
+        for values in cases:
+            expected = tides_module._subtract_mean_numpy(values)
+            assert np.allclose(tides_module._subtract_mean(values), expected, equal_nan=True)
+            assert np.allclose(tides_module._remove_mean(values), expected, equal_nan=True)
+
+        assert np.allclose(
+            tides_module._subtract_mean_numpy(np.array([nan, 1.0, 3.0, nan])),
+            [nan, -1.0, 1.0, nan], equal_nan=True)
+
+    def test_linear_regression_matches_scipy(self):
+
+        from scipy.stats import linregress
+
+        gauge_files = ['data/1946ABE.txt', 'data/1947ABE.txt']
+        data1 = read_tidal_data(gauge_files[1])
+        data2 = read_tidal_data(gauge_files[0])
+        data = join_data(data1, data2)
+
+        slope, p_value = sea_level_rise(data)
+
+        valid = data.dropna(subset=['Sea Level'])
+        days = (valid.index - valid.index[0]).total_seconds() / 86400
+        expected = linregress(days, valid['Sea Level'].astype(np.float64))
+
+        assert slope == pytest.approx(expected.slope, rel=1e-9)
+        assert p_value == pytest.approx(expected.pvalue, rel=1e-9)
+        assert slope == pytest.approx(2.848e-05, abs=1e-8)
+        assert p_value == pytest.approx(0.444, abs=1e-3)
+
+    def test_join_many(self):
+
+        data1 = read_tidal_data('data/1947ABE.txt')
+        data2 = read_tidal_data('data/1946ABE.txt')
+
+        # three frames, none of them in date order with the next
+        frames = [data1.iloc[4000:], data2, data1.iloc[:4000]]
+        data = join_many(frames)
+
+        assert data['Sea Level'].size == 8760*2
+        assert data.index.is_monotonic_increasing
+        pd.testing.assert_frame_equal(data, join_data(data1, data2))
+
+    def test_tides_match_uptide(self):
+
+        import uptide
+
+        gauge_files = ['data/1946ABE.txt', 'data/1947ABE.txt']
+        data1 = read_tidal_data(gauge_files[1])
+        data2 = read_tidal_data(gauge_files[0])
+        data = join_data(data1, data2)
+        start_datetime = datetime.datetime(1946,1,15,0,0,0)
+
+        segment = extract_section_remove_mean("19460115", "19470310", data)
+        for constituents, section in [
+                (['M2', 'S2'], segment),
+                (['M2', 'S2', 'N2', 'K2', 'O1', 'K1', 'P1', 'Q1'], segment),
+                # too few values for the normal equations
+                (['M2', 'S2'], segment.iloc[:3]),
+                (['M2', 'S2'], segment.iloc[:0])]:
+            amp, pha = tidal_analysis(section, constituents, start_datetime)
+
+            tide = uptide.Tides(constituents)
+            tide.set_initial_time(start_datetime)
+            sea_level = section['Sea Level'].to_numpy(dtype=np.float64)
+            seconds = (section.index - start_datetime).total_seconds().to_numpy()
+            is_a_number = ~np.isnan(sea_level)
+            expected_amp, expected_pha = uptide.harmonic_analysis(
+                tide, sea_level[is_a_number], seconds[is_a_number])
+
+            assert amp == pytest.approx(expected_amp, abs=1e-9)
+            # compare phases round the circle
+            assert np.abs(np.angle(np.exp(1j * (pha - expected_pha)))) == pytest.approx(0, abs=1e-9)
+
+    def test_extract_section_bounds(self):
+
+        gauge_files = ['data/1946ABE.txt', 'data/1947ABE.txt']
+
+        data1 = read_tidal_data(gauge_files[1])
+        data2 = read_tidal_data(gauge_files[0])
+        data = join_data(data1, data2)
+
+        # a shorter date covers the whole period, as slicing with .loc does
+        year1947 = extract_section_remove_mean("1947", "1947", data)
+        assert year1947['Sea Level'].size == 8760
+        assert year1947.index[0] == pd.Timestamp('1947-01-01 00:00:00')
+        assert year1947.index[-1] == pd.Timestamp('1947-12-31 23:00:00')
+
+        # timezone aware data is sliced in its own timezone
+        section = extract_section_remove_mean(
+            "19460115", "19460120", data.tz_localize("UTC"))
+        assert section['Sea Level'].size == 144
+        assert section.index[0] == pd.Timestamp('1946-01-15 00:00:00', tz="UTC")
+        assert section.index[-1] == pd.Timestamp('1946-01-20 23:00:00', tz="UTC")
+
+        # the dates must be in order to find a section
+        unsorted = pd.concat([data1, data2])
+        with pytest.raises(ValueError):
+            extract_section_remove_mean("19461215", "19470310", unsorted)
+        with pytest.raises(ValueError):
+            extract_single_year_remove_mean("1947", unsorted)
+
+    def test_correct_tides_index_unit(self):
+
+        gauge_files = ['data/1946ABE.txt', 'data/1947ABE.txt']
+        data1 = read_tidal_data(gauge_files[1])
+        data2 = read_tidal_data(gauge_files[0])
+        data = join_data(data1, data2)
+
+        data_segment = extract_section_remove_mean("19460115", "19470310", data)
+        start_datetime = datetime.datetime(1946,1,15,0,0,0)
+        expected_amp, expected_pha = tidal_analysis(
+            data_segment, ['M2', 'S2'], start_datetime)
+
+        # the result should not depend on the unit the index is stored in
+        for unit in ["s", "ms", "us"]:
+            data_unit = data_segment.set_axis(data_segment.index.as_unit(unit))
+            amp, pha = tidal_analysis(data_unit, ['M2', 'S2'], start_datetime)
+            assert amp == pytest.approx(expected_amp, abs=1e-9)
+            assert pha == pytest.approx(expected_pha, abs=1e-9)
+
+    def test_linear_regression_index_unit(self):
+
+        gauge_files = ['data/1946ABE.txt', 'data/1947ABE.txt']
+        data1 = read_tidal_data(gauge_files[1])
+        data2 = read_tidal_data(gauge_files[0])
+        data = join_data(data1, data2)
+
+        expected_slope, expected_p_value = sea_level_rise(data)
+
+        # the result should not depend on the unit the index is stored in
+        for unit in ["s", "ms", "us"]:
+            data_unit = data.set_axis(data.index.as_unit(unit))
+            slope, p_value = sea_level_rise(data_unit)
+            assert slope == pytest.approx(expected_slope, rel=1e-9)
+            assert p_value == pytest.approx(expected_p_value, rel=1e-9)
@@ -12,21 +12,118 @@
 # import the modules you need here
 # from datetime import datetime
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import glob
+import os
 #import datetime
 import pandas as pd
 import numpy as np
-from matplotlib import dates
 import scipy as sp
 import uptide
 #import pytz
 
+# numba is optional; without it the numpy versions of the kernels are used
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# bottleneck is optional; it gives a faster nanmean than numpy's
+try:
+    from bottleneck import nanmean
+except ImportError:
+    from numpy import nanmean
+
+
+# copy on write lets pandas share data between frames until one of them is
+# changed, rather than copying when slicing or setting the index
+pd.set_option("mode.copy_on_write", True)
+
+# the version of the feather copies of the data files, increase this when
+# changing how the files are read so old copies are not used
+CACHE_VERSION = 1
 
 # making the column names global so can easily be changed and reduces
 # the risk of typos occuring
 columnNames = ["Index", "Date", "Time", "Sea Level", "Sea Level Rise"]
 
 
+def _parse_flagged(value):
+    """
+    converts a single sea level value from a data file to a float.
+
+    Args:
+        value: the value as a string, which may end in a quality flag
+
+    Returns:
+        the value as a float, or nan if it is flagged with M, N or T
+    """
+    if value[-1] in "MNT":
+        return np.nan
+    return float(value)
+
+
+def _cache_filename(filename):
+    """
+    gives the name of the feather copy of a data file.
+
+    Args:
+        filename: the name of the data file
+
+    Returns:
+        the name of the feather file saved alongside the data file
+    """
+    return f"{filename}.v{CACHE_VERSION}.feather"
+
+
 def read_tidal_data(filename):
+    """
+    reads a text file containing tidal data, using a feather copy of the
+    parsed data saved alongside the file when it is newer than the file.
+    Setting the environment variable TIDAL_ANALYSIS_CACHE to 0 turns the
+    feather copy off.
+
+    Args:
+        filename: the name of the data file to read.
+
+    Returns:
+        data: the data frame containing the data with the header stripped out
+        and formatted with column names held in a global variable "columnnames"
+
+    Raises:
+        exception: If the file cannot be found.
+    """
+    if os.environ.get("TIDAL_ANALYSIS_CACHE", "1") == "0":
+        return _read_tidal_data_file(filename)
+
+    cache_filename = _cache_filename(filename)
+    try:
+        if os.path.getmtime(cache_filename) >= os.path.getmtime(filename):
+            return pd.read_feather(cache_filename).set_index("DateTime")
+    # no cached copy (or no data file, which is reported when reading below),
+    # or a copy that cannot be read, so parse the file again
+    except (OSError, ValueError, KeyError, ImportError):
+        pass
+
+    data = _read_tidal_data_file(filename)
+
+    # save the parsed data so the file does not need parsing next time. It
+    # is written to a temporary file and then moved into place, so a reader
+    # never sees a half written copy. This needs pyarrow and a writable
+    # directory so carry on without it
+    temp_filename = f"{cache_filename}.{os.getpid()}.tmp"
+    try:
+        data.reset_index().to_feather(temp_filename)
+        os.replace(temp_filename, cache_filename)
+    except (ImportError, OSError):
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+
+    return data
+
+
+def _read_tidal_data_file(filename):
     """
     reads a text file containing tidal data.
 
@@ -49,45 +146,35 @@ def read_tidal_data(filename):
     try:
         data = pd.read_csv(
             filename,
-            delim_whitespace=True,
+            sep=r"\s+",
             header=None,
             skiprows=no_of_header_rows_to_skip,
             names=columnNames,
+            # the index column is not needed so is not read, and the date
+            # and time are kept as strings until they are parsed below
+            usecols=columnNames[1:],
+            dtype={columnNames[1]: "string", columnNames[2]: "string"},
+            engine="c",
+            # values flagged with M, N or T are converted to nan as parsed
+            converters={
+                columnNames[3]: _parse_flagged,
+                columnNames[4]: _parse_flagged,
+            },
         )
 
-        # find the date/time in the columns
-        data["DateTime"] = pd.to_datetime(
-            data["Date"] + " " + data["Time"], format="%Y/%m/%d %H:%M:%S"
-        )
-
-        # set the data index using the datatime as the reference
-        data.set_index("DateTime", inplace=True)
-
-        # now we need to find the NaN values that may be present and
-        # replace them with nan. Wwe can use the numpy nan value
-        # applied to sea level
-        data.replace(
-            to_replace=".*M$", value={columnNames[3]: np.nan}, regex=True, inplace=True
-        )
-        data.replace(
-            to_replace=".*N$", value={columnNames[3]: np.nan}, regex=True, inplace=True
-        )
-        data.replace(
-            to_replace=".*T$", value={columnNames[3]: np.nan}, regex=True, inplace=True
-        )
-        # applied to sea level rise
-        data.replace(
-            to_replace=".*M$", value={columnNames[4]: np.nan}, regex=True, inplace=True
-        )
-        data.replace(
-            to_replace=".*N$", value={columnNames[4]: np.nan}, regex=True, inplace=True
-        )
-        data.replace(
-            to_replace=".*T$", value={columnNames[4]: np.nan}, regex=True, inplace=True
-        )
+        # the files hold sea level to a tenth of a mm at most, which float32
+        # keeps with half the memory of float64. The calculations below
+        # convert back to float64 so their sums stay accurate
+        data = data.astype({columnNames[3]: np.float32, columnNames[4]: np.float32})
 
-        # convert the sea level to a floating point type
-        data[columnNames[3]] = data[columnNames[3]].astype(float)
+        # find the date/time in the columns. The date and time are parsed
+        # separately and added together to avoid joining the strings, and
+        # caching means each distinct day is only parsed once
+        # then set the data index using the datatime as the reference
+        data = data.assign(
+            DateTime=pd.to_datetime(data["Date"], format="%Y/%m/%d", cache=True)
+            + pd.to_timedelta(data["Time"])
+        ).set_index("DateTime")
 
         # return the data
         return data
@@ -97,6 +184,107 @@ def read_tidal_data(filename):
         raise FileNotFoundError(f"The file {filename} does not exist") from exc
 
 
+def _subtract_mean(values):
+    """
+    subtracts the mean of the values that are not nan from every value.
+
+    Args:
+        values: a numpy array of floats
+
+    Returns:
+        a new array of the values with the mean removed
+    """
+    total = 0.0
+    count = 0
+    for i in range(values.size):
+        # nan is the only value that is not equal to itself
+        if values[i] == values[i]:
+            total += values[i]
+            count += 1
+    mean = total / count if count > 0 else np.nan
+    centred = np.empty_like(values)
+    for i in range(values.size):
+        centred[i] = values[i] - mean
+    return centred
+
+
+def _subtract_mean_numpy(values):
+    """
+    subtracts the mean of the values that are not nan using numpy, or
+    bottleneck's nanmean when it is installed.
+
+    Args:
+        values: a numpy array of floats
+
+    Returns:
+        a new array of the values with the mean removed
+    """
+    return values - nanmean(values)
+
+
+# use the compiled single pass kernel when numba is available
+if njit is None:
+    _remove_mean = _subtract_mean_numpy
+else:
+    _remove_mean = njit(cache=True, boundscheck=False)(_subtract_mean)
+
+
+def _slice_bounds(index, start, end):
+    """
+    finds the positions of the rows between two dates, so the data can be
+    sliced by position rather than by label.
+
+    Args:
+        index: a sorted DatetimeIndex
+        start: date in the format YYYYMMDD, or a shorter date such as YYYY
+        end: date in the format YYYYMMDD, or a shorter date such as YYYY,
+            which is included in full
+
+    Returns:
+        first and (exclusive) last position of the rows between the dates
+
+    Raises:
+        ValueError: If the index is not sorted by date.
+    """
+    # searching for the positions only works when the dates are in order
+    if not index.is_monotonic_increasing:
+        raise ValueError("The data must be sorted by date to extract a section")
+    # as with .loc, a date covers the whole period it describes, so "1947"
+    # runs from the start of the first day to the end of the last
+    start_time = pd.Period(str(start)).start_time
+    end_time = pd.Period(str(end)).end_time
+    # the dates are in the index's timezone, as they would be with .loc
+    if index.tz is not None:
+        start_time = start_time.tz_localize(index.tz)
+        end_time = end_time.tz_localize(index.tz)
+    first = index.searchsorted(start_time, side="left")
+    last = index.searchsorted(end_time, side="right")
+    return first, last
+
+
+def _extract_remove_mean(start, end, data):
+    """
+    extracts the sea level between two dates and removes its mean.
+
+    Args:
+        start: date in the format YYYYMMDD
+        end: date in the format YYYYMMDD, which is included in full
+        data: the data frame, sorted by its DatetimeIndex
+
+    Raises:
+        ValueError: If the data is not sorted by date.
+
+    Returns:
+        a data frame containing only the sea level with the mean removed
+    """
+    first, last = _slice_bounds(data.index, start, end)
+    sea_level = data[columnNames[3]].to_numpy()[first:last].astype(np.float64)
+
+    return pd.DataFrame(
+        {columnNames[3]: _remove_mean(sea_level)}, index=data.index[first:last]
+    )
+
+
 def extract_section_remove_mean(start, end, data):
     """
     extracts a portion of the date between a start and end date.
@@ -112,16 +300,7 @@ def extract_section_remove_mean(start, end, data):
     """
     # start is a date in the format YYYYMMDD
     # end is a date in the format YYYYMMDD
-
-    # convert start and end into strings data
-    data_string_start = str(start)
-    data_string_end = str(end)
-
-    extracted_data = data.loc[data_string_start:data_string_end, [columnNames[3]]]
-
-    # remove mean
-    mmm = np.mean(extracted_data[columnNames[3]])
-    extracted_data[columnNames[3]] -= mmm
+    extracted_data = _extract_remove_mean(start, end, data)
 
     return extracted_data
 
@@ -140,14 +319,32 @@ def join_data(data1, data2):
         exception: If the data joining fails.
     """
     # Concatenate the data and return the joined data
-    # to pass the test, the order of the data concatenation is important
-    # i.e. we add data2 to data1
+    # i.e. we add data2 to data1, the result is then sorted by date
+    return join_many([data2, data1])
+
+
+def join_many(frames):
+    """
+    combines any number of sets of data into a single dataframe sorted
+    by date. Joining all of the data at once avoids copying it again for
+    every file, as happens when calling join_data in a loop.
+
+    Args:
+        frames: a list of data frames
+
+    Returns:
+        data: the dataframe containing the concatenated dataframes
+
+    Raises:
+        exception: If the data joining fails.
+    """
     try:
-        data = pd.concat([data2, data1])
+        data = pd.concat(frames)
     # Catching a TypeError which can occur if a non-string element is in the list
     except TypeError as exc:
         raise ValueError(f"Concatenation error joining data: {exc}") from exc
-    return data
+    # a stable sort keeps the order of any duplicated times
+    return data.sort_index(kind="mergesort")
 
 
 def extract_single_year_remove_mean(year, data):
@@ -166,10 +363,7 @@ def extract_single_year_remove_mean(year, data):
     # copied code from SEPwC documentation
     year_string_start = str(year) + "0101"
     year_string_end = str(year) + "1231"
-    year_data = data.loc[year_string_start:year_string_end, [columnNames[3]]]
-    # remove mean
-    mmm = np.mean(year_data[columnNames[3]])
-    year_data[columnNames[3]] -= mmm
+    year_data = _extract_remove_mean(year_string_start, year_string_end, data)
 
     return year_data
 
@@ -184,18 +378,134 @@ def sea_level_rise(data):
     Returns:
         slope and p_value from the data frame
     """
-    # drop any nan values from the data in the Sea Level column
-    data = data.dropna(subset=[columnNames[3]])
+    # read_tidal_data already gives a DatetimeIndex, so only convert
+    # the index if we have been given something else
+    index = data.index
+    if not isinstance(index, pd.DatetimeIndex):
+        index = pd.to_datetime(index)
+
+    # ignore any nan values in the Sea Level column, making sure the
+    # array is contiguous in memory whatever the frame's layout
+    y_value = np.ascontiguousarray(data[columnNames[3]].to_numpy(dtype=np.float64))
+    is_a_number = ~np.isnan(y_value)
+    y_value = y_value[is_a_number]
+    # days since the first time, calculated directly from the nanosecond
+    # timestamps. Counting from the first time rather than the epoch keeps
+    # the values small, which helps the precision of the fit. asi8 is in
+    # whatever unit the index is stored in so convert it to nanoseconds
+    timestamps = index.as_unit("ns").asi8
+    x_value = (timestamps[is_a_number] - timestamps[:1]).astype(np.float64) / 86_400e9
+
+    # least squares fit of a straight line, we only need the slope and
+    # p-value so calculate them directly rather than using linregress
+    n_values = x_value.size
+    x_diff = x_value - x_value.mean()
+    y_diff = y_value - y_value.mean()
+    s_xx = np.dot(x_diff, x_diff)
+    s_xy = np.dot(x_diff, y_diff)
+    s_yy = np.dot(y_diff, y_diff)
+    slope = s_xy / s_xx
+
+    # two-sided p-value for the slope from the t distribution
+    t_value = slope * np.sqrt((n_values - 2) * s_xx / (s_yy - slope * s_xy))
+    p_value = 2 * sp.stats.t.sf(np.abs(t_value), n_values - 2)
 
-    data.index = pd.to_datetime(data.index)
+    # Return the slope and p-value
+    return slope, p_value
 
-    x_value = dates.date2num(data.index)
-    y_value = data[columnNames[3]]
+def _normal_equations(omega, seconds, sea_level):
+    """
+    builds the least squares normal equations for a harmonic fit without
+    storing the full matrix of sines and cosines.
 
-    slope, p_value, _, _, _ = sp.stats.linregress(x_value, y_value)
+    Args:
+        omega: angular frequencies of the constituents in radians/second
+        seconds: seconds since the start time of each value
+        sea_level: the sea level values
+
+    Returns:
+        lhs and rhs of the normal equations for the coefficients
+        [Z0, B_1..B_M, C_1..C_M] of Z0 + sum B cos(omega t) + C sin(omega t)
+    """
+    n_constituents = omega.size
+    n_columns = 2 * n_constituents + 1
+    lhs = np.zeros((n_columns, n_columns))
+    rhs = np.zeros(n_columns)
+    row = np.empty(n_columns)
+    for i in range(seconds.size):
+        # one row of the design matrix
+        row[0] = 1.0
+        for k in range(n_constituents):
+            row[1 + k] = np.cos(omega[k] * seconds[i])
+            row[1 + n_constituents + k] = np.sin(omega[k] * seconds[i])
+        # accumulate the upper triangle of A^T A and A^T x
+        for j in range(n_columns):
+            rhs[j] += row[j] * sea_level[i]
+            for k in range(j, n_columns):
+                lhs[j, k] += row[j] * row[k]
+    # A^T A is symmetric so copy the upper triangle to the lower
+    for j in range(n_columns):
+        for k in range(j):
+            lhs[j, k] = lhs[k, j]
+    return lhs, rhs
+
+
+def _harmonic_analysis(tide, sea_level, seconds, build_normal_equations):
+    """
+    performs harmonic analysis as uptide.harmonic_analysis does, but
+    solves the normal equations built by a compiled kernel rather than
+    the full least squares problem.
+
+    Args:
+        tide: the uptide Tides object with the initial time set
+        sea_level: the sea level values, with no nan values
+        seconds: seconds since the initial time of each value
+        build_normal_equations: the compiled _normal_equations kernel
+
+    Returns:
+        amp: Amplitude of tidal constituents.
+        pha: Phase of tidal constituents.
+    """
+    # uptide handles Z0 as a constituent differently, and with fewer values
+    # than coefficients the normal equations are singular, so leave these
+    # to uptide
+    n_constituents = len(tide.omega)
+    if "Z0" in tide.constituents or seconds.size < 2 * n_constituents + 1:
+        return uptide.harmonic_analysis(tide, sea_level, seconds)
+
+    lhs, rhs = build_normal_equations(
+        np.asarray(tide.omega, dtype=np.float64), seconds, sea_level
+    )
+    # forming the normal equations squares the condition number, so if the
+    # system is (nearly) singular let uptide solve the least squares directly
+    if np.linalg.cond(lhs) > 1e10:
+        return uptide.harmonic_analysis(tide, sea_level, seconds)
+    try:
+        coefficients = np.linalg.solve(lhs, rhs)
+    except np.linalg.LinAlgError:
+        return uptide.harmonic_analysis(tide, sea_level, seconds)
+
+    # convert the cos and sin coefficients to amplitude and phase in the
+    # same way as uptide
+    complex_amp = (
+        coefficients[1:n_constituents + 1]
+        - 1j * coefficients[n_constituents + 1:]
+    )
+    amp = np.abs(complex_amp) / tide.f
+    pha = (tide.phi + tide.u - np.angle(complex_amp)) % (2 * np.pi)
+    return amp, pha
+
+
+# use the compiled normal equations when numba is available. Building them
+# in python would be far too slow, so without numba leave the fit to uptide
+if njit is None:
+    _fit_constituents = uptide.harmonic_analysis
+else:
+    _fit_constituents = partial(
+        _harmonic_analysis,
+        build_normal_equations=njit(cache=True, boundscheck=False)(_normal_equations),
+    )
 
-    # Return the slope and p-value
-    return slope, p_value
 
 def tidal_analysis(data, constituents, start_datetime):
     """
@@ -220,23 +530,78 @@ def tidal_analysis(data, constituents, start_datetime):
     tide = uptide.Tides(constituents)
     tide.set_initial_time(start_datetime)
     # Make the data index timezone naive
-    data.index = data.index.tz_localize(None)
-    # Calculate the number of seconds since start time
-    seconds_since = (data.index - start_datetime).total_seconds()
-    # Convert sea level to a numpy array
-    sl = data[columnNames[3]].values
+    index = data.index
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    # Calculate the number of seconds since start time using the integer
+    # nanosecond timestamps, converting the index to nanoseconds first as
+    # asi8 is in whatever unit the index is stored in
+    seconds_since = (
+        index.as_unit("ns").asi8 - pd.Timestamp(start_datetime).value
+    ).astype(np.float64) / 1e9
+    # Convert sea level to a numpy array that is contiguous in memory
+    sl = np.ascontiguousarray(data[columnNames[3]].to_numpy(dtype=np.float64))
 
     # Filter out NaN values
-    is_a_number = pd.notna(sl)
-    sl = sl[is_a_number]
-    seconds_since = seconds_since[is_a_number]
+    is_a_number = np.isfinite(sl)
 
     # Perform harmonic analysis
-    amp, pha = uptide.harmonic_analysis(tide, sl, seconds_since)
+    amp, pha = _fit_constituents(tide, sl[is_a_number], seconds_since[is_a_number])
 
     return amp, pha
 
 
+def _longest_run(values):
+    """
+    finds the longest run of values that are not nan in a single pass.
+
+    Args:
+        values: a numpy array of floats
+
+    Returns:
+        start and (exclusive) end index of the longest run
+    """
+    best_start = best_end = current_start = 0
+    for i in range(values.size):
+        # nan is the only value that is not equal to itself
+        if values[i] == values[i]:
+            if i + 1 - current_start > best_end - best_start:
+                best_start, best_end = current_start, i + 1
+        else:
+            current_start = i + 1
+    return best_start, best_end
+
+
+def _longest_run_numpy(values):
+    """
+    finds the longest run of values that are not nan using numpy.
+
+    Args:
+        values: a numpy array of floats
+
+    Returns:
+        start and (exclusive) end index of the longest run
+    """
+    # Needs bitwise invert so not_nan is true when numbers are not nan!
+    not_nan = ~np.isnan(values)
+    # pad with false either side so the changes between true and false
+    # give the start and (exclusive) end of each run of numbers
+    edges = np.flatnonzero(np.diff(np.r_[0, not_nan.view(np.int8), 0]))
+    starts, ends = edges[::2], edges[1::2]
+    # no numbers at all, so there is no contiguous data
+    if starts.size == 0:
+        return 0, 0
+    longest = (ends - starts).argmax()
+    return starts[longest], ends[longest]
+
+
+# use the compiled single pass scan when numba is available
+if njit is None:
+    _find_longest_run = _longest_run_numpy
+else:
+    _find_longest_run = njit(cache=True, boundscheck=False)(_longest_run)
+
+
 def get_longest_contiguous_data(data):
     """
     reads a data frame and works out the largets chunk of contiguous data.
@@ -248,17 +613,11 @@ def get_longest_contiguous_data(data):
         contiguous_data frame
     """
 
-    # identify the not a number values from the 4th col of the dataframe
-    # this should be sea level. Needs bitwise invert so not_nan is true
-    # when numbers are not nan!
-    not_nan = ~data[columnNames[3]].isna()
-    # cummulatively sum the data over the series so result is a series
-    # of contiguos groups of true and false
-    groups = (not_nan != not_nan.shift()).cumsum()
-    # find the an integer to the most frequent integer in the group
-    largest_group = groups.value_counts().idxmax()
+    # take the 4th col of the dataframe, this should be sea level
+    sea_level = data[columnNames[3]].to_numpy()
+    start, end = _find_longest_run(sea_level)
     # select the block of most contiguous numbers that are not nan
-    contiguous_data = data[groups == largest_group]
+    contiguous_data = data.iloc[start:end]
 
     return contiguous_data
 
@@ -281,3 +640,42 @@ if __name__ == "__main__":
     args = parser.parse_args()
     dirname = args.directory
     verbose = args.verbose
+
+    # each file is read independently so read them in parallel, then join
+    # them all at once
+    files = sorted(glob.glob(os.path.join(dirname, "*.txt")))
+    if not files:
+        parser.error(f"no txt files found in {dirname}")
+    if verbose:
+        print(f"Reading {len(files)} files from {dirname}")
+    max_workers = min(len(files), os.cpu_count() or 1)
+    if max_workers == 1:
+        # a single worker process would only add the cost of starting it
+        # and importing the modules again, so read the files here
+        all_data = join_many([read_tidal_data(file) for file in files])
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            all_data = join_many(list(pool.map(read_tidal_data, files)))
+
+    if verbose:
+        print("Calculating tidal constituents")
+    station_amp, station_pha = tidal_analysis(
+        all_data, ["M2", "S2"], all_data.index[0].to_pydatetime()
+    )
+    rise_per_day, rise_p_value = sea_level_rise(all_data)
+    longest_data = get_longest_contiguous_data(all_data)
+
+    print(f"Station: {os.path.basename(os.path.normpath(dirname))}")
+    print(f"M2 amplitude: {station_amp[0]:.3f} m, phase: {station_pha[0]:.3f} rad")
+    print(f"S2 amplitude: {station_amp[1]:.3f} m, phase: {station_pha[1]:.3f} rad")
+    print(
+        f"Sea level rise: {rise_per_day * 365:.5f} m/year "
+        f"(p-value {rise_p_value:.3f})"
+    )
+    if longest_data.empty:
+        print("Longest contiguous data: none")
+    else:
+        print(
+            f"Longest contiguous data: {longest_data.index[0]} to "
+            f"{longest_data.index[-1]} ({len(longest_data)} values)"
+        )